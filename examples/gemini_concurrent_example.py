@@ -1,17 +1,20 @@
 import os
-import time
-import json
-import concurrent.futures
-import threading
+import asyncio
+import functools
 
+import orjson
 from dotenv import load_dotenv
 from dataclasses import dataclass
-from tqdm import tqdm
+from typing import Final
+from tqdm.asyncio import tqdm
 
 from google import genai
+from google.genai import errors
 
 # Import rate_limit from rateguard
-from rateguard import rate_limit
+from rateguard import RateLimitExceeded, rate_limit
+
+from llm_cache import cached_llm, stats
 
 # Load environment variables from .env file
 load_dotenv()
@@ -31,100 +34,174 @@ available_models: dict[str, str] = {
 
 
 # Constant configuration
-@dataclass(frozen=True)
-class Config:
-    MODEL_NAME: str = available_models.get("gemini-2.0-flash")
-    MODEL_RPM: int = 15
+MODEL_NAME: Final[str] = available_models["gemini-2.0-flash"]
+MODEL_RPM: Final[int] = 15
+# Maximum number of requests in flight at once, sized to the rate budget:
+# at 15 RPM a request starts every 4 s, so a few in flight cover the API latency
+MAX_CONCURRENCY: Final[int] = max(2, MODEL_RPM // 4)
+# Number of questions packed into a single request
+BATCH_SIZE: Final[int] = 5
 
+# Caps the number of requests in flight
+semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
 
-def build_prompt(row: dict) -> str:
-    # Construct a prompt using the question text from the row
-    question = row.get("Question", "No question provided.")
-    return f"Please generate related questions for: {question}"
 
+@dataclass(slots=True, frozen=True)
+class Row:
+    # A single question to generate related questions for
+    question_id: str
+    question: str
 
-@rate_limit(rpm=Config.MODEL_RPM)
-def rate_limited_api_call(prompt: str):
-    # Call the API to generate content based on the prompt
-    return client.models.generate_content(model=Config.MODEL_NAME, contents=prompt)
 
+# Instructions shared by every batch prompt
+PROMPT_HEADER: str = (
+    "Please generate related questions for each of the following questions.\n"
+    "Return a JSON object mapping each question id to a list of related questions, "
+    'e.g. {"Q1": ["...", "..."], "Q2": ["..."]}.\n\n'
+)
 
-def process_row(row: dict):
-    """
-    Process a single row: build a prompt, call the API (with rate limiting),
-    and return a tuple with the question id and the result dictionary.
-    """
-    question_id = row.get("Question Id")
-    question_text = row.get("Question")
-    prompt = build_prompt(row)
+# Pre-bound template for a single question line
+QUESTION_TMPL = "{}: {}".format
 
-    # Call the API to generate content for the current row
-    response = rate_limited_api_call(prompt)
 
-    # Return a tuple of the question_id and a dictionary with the needed data
-    return question_id, {
-        "main_question": question_text,
-        "generated_questions": response.text,
-    }
+@functools.lru_cache(maxsize=4096)
+def build_question_line(question_id: str, question: str) -> str:
+    # Format each unique question only once
+    return QUESTION_TMPL(question_id, question)
 
 
-def main():
-    # Define a list of 30 sample rows (each row is a dictionary)
-    records = [
-        {"Question Id": "Q1", "Question": "What is artificial intelligence?"},
-        {"Question Id": "Q2", "Question": "How does machine learning work?"},
-        {"Question Id": "Q3", "Question": "What is deep learning?"},
-        {"Question Id": "Q4", "Question": "Explain neural networks."},
-        {"Question Id": "Q5", "Question": "What is computer vision?"},
-        {"Question Id": "Q6", "Question": "How do recommendation systems work?"},
-        {"Question Id": "Q7", "Question": "What is natural language processing?"},
-        {"Question Id": "Q8", "Question": "Define reinforcement learning."},
-        {"Question Id": "Q9", "Question": "What are generative models?"},
-        {"Question Id": "Q10", "Question": "Explain supervised learning."},
-        {"Question Id": "Q11", "Question": "What is unsupervised learning?"},
-        {"Question Id": "Q12", "Question": "How does clustering work?"},
-        {"Question Id": "Q13", "Question": "What is regression analysis?"},
-        {"Question Id": "Q14", "Question": "Explain classification techniques."},
-        {"Question Id": "Q15", "Question": "What is data preprocessing?"},
-        {"Question Id": "Q16", "Question": "How do decision trees work?"},
-        {"Question Id": "Q17", "Question": "Explain random forests."},
-        {"Question Id": "Q18", "Question": "What is support vector machine?"},
-        {"Question Id": "Q19", "Question": "What is ensemble learning?"},
-        {"Question Id": "Q20", "Question": "Describe feature engineering."},
-        {"Question Id": "Q21", "Question": "What is hyperparameter tuning?"},
-        {"Question Id": "Q22", "Question": "How does cross-validation work?"},
-        {"Question Id": "Q23", "Question": "Explain gradient descent."},
-        {"Question Id": "Q24", "Question": "What are activation functions?"},
-        {"Question Id": "Q25", "Question": "Describe overfitting in models."},
-        {"Question Id": "Q26", "Question": "What is regularization?"},
-        {"Question Id": "Q27", "Question": "Explain convolutional neural networks."},
-        {"Question Id": "Q28", "Question": "What is recurrent neural network?"},
-        {"Question Id": "Q29", "Question": "Define transfer learning."},
-        {"Question Id": "Q30", "Question": "What is model deployment?"},
-    ]
+def build_batch_prompt(rows: list[Row]) -> str:
+    # Construct one prompt that lists every question of the batch under its id
+    return PROMPT_HEADER + "\n".join(
+        build_question_line(row.question_id, row.question) for row in rows
+    )
+
+
+def retry_delay(exc: errors.ClientError) -> float | None:
+    # Gemini reports the suggested wait as a RetryInfo detail, e.g. {"retryDelay": "30s"}
+    details = exc.details if isinstance(exc.details, dict) else {}
+    for detail in details.get("error", {}).get("details", []):
+        if "retryDelay" in detail:
+            return float(detail["retryDelay"].rstrip("s"))
+    return None
+
+
+@rate_limit(rpm=MODEL_RPM, max_retries=3)
+async def rate_limited_api_call(prompt: str) -> dict[str, list[str]]:
+    # Call the async API to generate content based on the prompt
+    try:
+        response = await client.aio.models.generate_content(
+            model=MODEL_NAME,
+            contents=prompt,
+            config={"response_mime_type": "application/json"},
+        )
+    except errors.ClientError as exc:
+        # Let rateguard back off and retry when the API reports a 429
+        if exc.code == 429:
+            raise RateLimitExceeded(retry_after=retry_delay(exc)) from exc
+        raise
+
+    # Parse and validate here so that only well-formed answers are cached
+    generated = orjson.loads(response.text)
+    if not isinstance(generated, dict):
+        raise ValueError(f"Expected a JSON object, got: {response.text!r}")
+    return generated
 
-    # Use ThreadPoolExecutor to process rows concurrently
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        results = list(
-            tqdm(
-                executor.map(process_row, records),
-                total=len(records),
-                desc="Processing rows",
-            )
+
+# Cache hits return before the semaphore and the rate limit are consulted
+@cached_llm(model=MODEL_NAME)
+async def generate_related_questions(prompt: str) -> dict[str, list[str]]:
+    # Take the semaphore before the rate limit, so a call that got its slot starts
+    # right away instead of queueing and then bursting with others
+    async with semaphore:
+        return await rate_limited_api_call(prompt)
+
+
+async def process_batch(rows: list[Row]):
+    """
+    Process a batch of rows with a single API call (with rate limiting),
+    and return a list of tuples with the question id and the result dictionary.
+    """
+    prompt = build_batch_prompt(rows)
+
+    # Call the API once for the whole batch to get the answers per question id
+    generated = await generate_related_questions(prompt)
+
+    # Return a tuple of the question_id and a dictionary with the needed data for every row
+    return [
+        (
+            row.question_id,
+            {
+                "main_question": row.question,
+                "generated_questions": generated.get(row.question_id, []),
+            },
         )
+        for row in rows
+    ]
 
-    # Convert list of tuples to a dictionary (assuming process_row returns (question_id, result_dict))
-    responses_dict = dict(results)
+
+async def main():
+    # Define a list of 30 sample rows
+    records = [
+        Row("Q1", "What is artificial intelligence?"),
+        Row("Q2", "How does machine learning work?"),
+        Row("Q3", "What is deep learning?"),
+        Row("Q4", "Explain neural networks."),
+        Row("Q5", "What is computer vision?"),
+        Row("Q6", "How do recommendation systems work?"),
+        Row("Q7", "What is natural language processing?"),
+        Row("Q8", "Define reinforcement learning."),
+        Row("Q9", "What are generative models?"),
+        Row("Q10", "Explain supervised learning."),
+        Row("Q11", "What is unsupervised learning?"),
+        Row("Q12", "How does clustering work?"),
+        Row("Q13", "What is regression analysis?"),
+        Row("Q14", "Explain classification techniques."),
+        Row("Q15", "What is data preprocessing?"),
+        Row("Q16", "How do decision trees work?"),
+        Row("Q17", "Explain random forests."),
+        Row("Q18", "What is support vector machine?"),
+        Row("Q19", "What is ensemble learning?"),
+        Row("Q20", "Describe feature engineering."),
+        Row("Q21", "What is hyperparameter tuning?"),
+        Row("Q22", "How does cross-validation work?"),
+        Row("Q23", "Explain gradient descent."),
+        Row("Q24", "What are activation functions?"),
+        Row("Q25", "Describe overfitting in models."),
+        Row("Q26", "What is regularization?"),
+        Row("Q27", "Explain convolutional neural networks."),
+        Row("Q28", "What is recurrent neural network?"),
+        Row("Q29", "Define transfer learning."),
+        Row("Q30", "What is model deployment?"),
+    ]
+
+    # Split the rows into batches so each API call answers several questions
+    batches = [
+        records[i : i + BATCH_SIZE]
+        for i in range(0, len(records), BATCH_SIZE)
+    ]
 
     # Create a unique output filename based on the model name
     OUTPUT_FILE: str = (
-        f"generated_response_{'_'.join(Config.MODEL_NAME.split('.'))}.json"
+        f"generated_response_{'_'.join(MODEL_NAME.split('.'))}.jsonl"
     )
 
-    # Save the dictionary of responses to a JSON file
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as json_file:
-        json.dump(responses_dict, json_file, indent=4, ensure_ascii=False)
+    # Process batches concurrently and write each one as soon as it completes,
+    # one JSON object per question (NDJSON), so finished results never wait in memory
+    with open(OUTPUT_FILE, "wb") as output_file:
+        for future in tqdm.as_completed(
+            [process_batch(batch) for batch in batches],
+            total=len(batches),
+            desc="Processing batches",
+        ):
+            for question_id, data in await future:
+                output_file.write(
+                    orjson.dumps({"question_id": question_id, **data}) + b"\n"
+                )
+            output_file.flush()
+
+    print(f"Cache hits: {stats['hits']}, misses: {stats['misses']}")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+import json
+import hashlib
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional
+
+import diskcache
+
+# Persistent on-disk cache shared by every cached function
+cache = diskcache.Cache("./.llmcache")
+
+# Cache statistics for the current process
+stats: dict[str, int] = {"hits": 0, "misses": 0}
+
+
+def cache_key(model: str, prompt: str) -> str:
+    # Hash the model and prompt together so different models never share entries
+    payload = json.dumps({"model": model, "prompt": prompt}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cached_llm(
+    model: str, ttl: Optional[float] = None
+) -> Callable[[Callable[[str], Awaitable[Any]]], Callable[[str], Awaitable[Any]]]:
+    """
+    Decorator that caches the result of an async LLM call on disk.
+
+    Place it outside any rate limiting so that cache hits never wait for a free slot.
+    Results are only cached when the call returns; validate the response inside the
+    decorated function and raise on bad output so that it is retried on the next run.
+
+    Args:
+        model (str): Model name that is part of the cache key.
+        ttl (Optional[float]): Seconds after which an entry expires. Never expires if None.
+    """
+
+    def decorator(func: Callable[[str], Awaitable[Any]]) -> Callable[[str], Awaitable[Any]]:
+        @wraps(func)
+        async def wrapper(prompt: str) -> Any:
+            key = cache_key(model, prompt)
+            result: Any = cache.get(key)
+            if result is not None:
+                stats["hits"] += 1
+                return result
+
+            stats["misses"] += 1
+            result = await func(prompt)
+            cache.set(key, result, expire=ttl)
+            return result
+
+        return wrapper
+
+    return decorator
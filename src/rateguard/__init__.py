@@ -1,3 +1,3 @@
-from .main import rate_limit
+from .main import RateLimitExceeded, TokenBucket, rate_limit
 
-__all__ = ["rate_limit"]
\ No newline at end of file
+__all__ = ["RateLimitExceeded", "TokenBucket", "rate_limit"]
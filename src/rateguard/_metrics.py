@@ -0,0 +1,32 @@
+from typing import Any
+
+
+class _NoopCounter:
+    """Stand-in for a Prometheus counter when 'prometheus_client' is not installed."""
+
+    def labels(self, *args: Any, **kwargs: Any) -> "_NoopCounter":
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+
+def _counter(name: str, documentation: str) -> Any:
+    # prometheus_client is an optional dependency ('rateguard[metrics]').
+    try:
+        from prometheus_client import Counter
+    except ImportError:
+        return _NoopCounter()
+    return Counter(name, documentation, ["function"])
+
+
+# Every counter is labelled by the qualified name of the decorated function.
+calls_total = _counter(
+    "rateguard_calls", "Number of calls that went through a rate limit."
+)
+throttled_total = _counter(
+    "rateguard_throttled", "Number of calls that had to wait for the rate limit."
+)
+wait_time_seconds_total = _counter(
+    "rateguard_wait_time_seconds", "Total time spent waiting for the rate limit."
+)
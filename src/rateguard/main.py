@@ -1,51 +1,314 @@
 import time
+import asyncio
+import inspect
 import threading
+from datetime import timedelta
 from functools import wraps
-from typing import Any, Callable, TypeVar
+from typing import Any, Awaitable, Callable, Optional, TypeVar, cast
 
+from ._metrics import calls_total, throttled_total, wait_time_seconds_total
 
 F = TypeVar("F", bound=Callable[..., Any])
 
+# Bound once so the hot path skips the attribute lookup on the time module.
+_monotonic = time.monotonic
+_sleep = time.sleep
 
-def rate_limit(rpm: int) -> Callable[[F], F]:
+# Seconds a coroutine waits before retrying a shared bucket whose file lock is busy.
+_LOCK_POLL_INTERVAL = 0.001
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised from a rate-limited function when the remote service rejects a call for exceeding
+    its rate limit, e.g. an HTTP 429 (Too Many Requests) response.
+
+    The decorator catches it, holds the limit back for 'retry_after' seconds and, if retries
+    are enabled, calls the function again once the limit allows it.
+
+    Args:
+        retry_after (Optional[float]): Seconds the service asked to wait, e.g. from a
+            'Retry-After' header. If None, the wait backs off exponentially from 60 / rpm.
+    """
+
+    def __init__(self, retry_after: Optional[float] = None) -> None:
+        super().__init__(
+            "Rate limit exceeded"
+            if retry_after is None
+            else f"Rate limit exceeded, retry after {retry_after} seconds"
+        )
+        self.retry_after: Optional[float] = retry_after
+
+
+def _retry_delay(exc: BaseException, interval: float, attempt: int) -> float:
+    # Honor the server's hint when the exception carries one, in seconds or as a timedelta.
+    for attr in ("retry_after", "retry_delay"):
+        hint: object = getattr(exc, attr, None)
+        if isinstance(hint, timedelta):
+            return hint.total_seconds()
+        if isinstance(hint, (int, float)):
+            return float(hint)
+
+    # Otherwise back off exponentially from the regular spacing.
+    return interval * 2.0**attempt
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that hands out 'rpm' tokens per minute.
+
+    Tokens are replenished lazily from the elapsed monotonic time and accrue up to 'burst' while
+    the bucket is idle, so that many calls can run back to back after a quiet period. A caller
+    reserves its token under a short-lived lock, letting the balance go negative when the bucket
+    is empty, and then sleeps off the deficit after releasing the lock. The lock is therefore
+    never held while waiting, and concurrent callers queue up behind each other's reservations.
+
+    Args:
+        rpm (int): Number of tokens replenished per minute.
+        burst (int): Maximum number of tokens the bucket can hold. The default of 1 keeps calls
+            strictly spaced by 60 / rpm seconds.
+        clock (Callable[[], float]): Monotonic clock returning seconds.
+        sleep (Callable[[float], None]): Function used by 'acquire' to wait.
+
+    Raises:
+        ValueError: If 'burst' is less than 1.
+    """
+
+    def __init__(
+        self,
+        rpm: int,
+        burst: int = 1,
+        clock: Callable[[], float] = _monotonic,
+        sleep: Callable[[float], None] = _sleep,
+    ) -> None:
+        if burst < 1:
+            raise ValueError(f"burst must be at least 1, got {burst}.")
+
+        self.rpm: int = rpm
+        self.burst: int = burst
+        # Tokens replenished per second, and its inverse, seconds per token.
+        self._rate: float = rpm / 60.0
+        self._interval: float = 60.0 / rpm
+        self._capacity: float = float(burst)
+        # The lock only guards the reservation; it is never held while sleeping.
+        self._lock = threading.Lock()
+        self._tokens: float = self._capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._last_refill: float = clock()
+
+    def reserve(self) -> float:
+        """Consume a token and return the number of seconds to wait before using it."""
+        with self._lock:
+            now: float = self._clock()
+            tokens: float = self._tokens + (now - self._last_refill) * self._rate
+            if tokens > self._capacity:
+                tokens = self._capacity
+            tokens -= 1.0
+            self._tokens = tokens
+            self._last_refill = now
+
+        # A negative balance is the time until this reservation's token is replenished.
+        return -tokens * self._interval if tokens < 0.0 else 0.0
+
+    def backoff(self, delay: float) -> None:
+        """Hold back the next token for at least 'delay' seconds from now."""
+        with self._lock:
+            now: float = self._clock()
+            tokens: float = self._tokens + (now - self._last_refill) * self._rate
+            if tokens > self._capacity:
+                tokens = self._capacity
+            # This balance refills to exactly one token after 'delay' seconds.
+            self._tokens = min(tokens, 1.0 - delay * self._rate)
+            self._last_refill = now
+
+    def try_reserve(self) -> Optional[float]:
+        """Like 'reserve', but return None instead of waiting for a lock held elsewhere."""
+        # The in-process lock is only held for a few arithmetic operations.
+        return self.reserve()
+
+    def try_backoff(self, delay: float) -> bool:
+        """Like 'backoff', but return False instead of waiting for a lock held elsewhere."""
+        self.backoff(delay)
+        return True
+
+    def acquire(self) -> None:
+        """Block until a token is available and consume it."""
+        delay: float = self.reserve()
+        if delay > 0.0:
+            self._sleep(delay)
+
+
+# Buckets shared by every decorator that uses the same scope, keyed by (scope, shared).
+_limiters: dict[tuple[str, bool], TokenBucket] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_bucket(
+    rpm: int,
+    burst: int,
+    scope: Optional[str],
+    shared: bool,
+    clock: Callable[[], float],
+    sleep: Callable[[float], None],
+) -> TokenBucket:
+    if shared:
+        scope = scope or "default"
+    elif scope is None:
+        # Unscoped decorators each get their own bucket.
+        return TokenBucket(rpm, burst, clock, sleep)
+
+    with _registry_lock:
+        bucket = _limiters.get((scope, shared))
+        if bucket is None:
+            if shared:
+                # Imported lazily because it relies on POSIX-only modules.
+                from .shared import SharedTokenBucket
+
+                bucket = SharedTokenBucket(rpm, burst, scope, clock, sleep)
+            else:
+                bucket = TokenBucket(rpm, burst, clock, sleep)
+            _limiters[(scope, shared)] = bucket
+
+    if (bucket.rpm, bucket.burst) != (rpm, burst):
+        raise ValueError(
+            f"Scope {scope!r} is already limited to {bucket.rpm} rpm with burst "
+            f"{bucket.burst}, got {rpm} rpm with burst {burst}."
+        )
+    if (bucket._clock, bucket._sleep) != (clock, sleep):
+        raise ValueError(f"Scope {scope!r} is already bound to a different clock.")
+    return bucket
+
+
+def rate_limit(
+    rpm: int,
+    scope: Optional[str] = None,
+    burst: int = 1,
+    shared: bool = False,
+    *,
+    retry_on: tuple[type[BaseException], ...] = (RateLimitExceeded,),
+    max_retries: int = 0,
+    _now: Callable[[], float] = _monotonic,
+    _sleep: Callable[[float], None] = _sleep,
+    _async_sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+) -> Callable[[F], F]:
     """
     Decorator to limit the number of function calls per minute.
 
     This decorator ensures that the decorated function is called at most 'rpm' times per minute.
-    If a call is made before the allowed interval has passed since the last call, the decorator
-    will sleep for the remaining time needed to enforce the rate limit.
+    Calls draw from a token bucket that is replenished lazily at 'rpm' tokens per minute. Each
+    call reserves its token under a short-lived lock and sleeps until the token is available
+    after releasing the lock, so concurrent callers never wait on each other's sleeps. With a
+    'burst' above 1, tokens saved up while idle let that many calls run without waiting, while
+    the long-run rate stays at 'rpm'.
+
+    Coroutine functions are supported as well: their wrapper waits with 'asyncio.sleep' so the
+    event loop keeps running other tasks while a call is being paced. With 'shared=True' it
+    also polls for the state file's lock instead of blocking the event loop on it.
+
+    When the decorated function raises one of 'retry_on', e.g. because the service answered
+    with HTTP 429, the limit is held back for the delay the service asked for (its
+    'retry_after' or 'retry_delay' attribute) or, without a hint, for an exponentially growing
+    multiple of 60 / rpm. Every caller sharing the limit then waits that long, instead of
+    retrying at the regular pace.
 
     Args:
         rpm (int): Maximum number of function calls allowed per minute.
+        scope (Optional[str]): Name of a limit shared by every function decorated with the same
+            scope, e.g. a provider's account-level quota. If None, the limit is private to this
+            decorator.
+        burst (int): Maximum number of calls that may run back to back after an idle period.
+            Defaults to 1, which spaces every call by 60 / rpm seconds.
+        shared (bool): If True, the limit is shared by every process on the host that uses the
+            same scope (or "default" when 'scope' is None), e.g. the workers of a
+            'ProcessPoolExecutor' or a multi-worker server. POSIX only.
+        retry_on (tuple[type[BaseException], ...]): Exceptions that signal the service's rate
+            limit was exceeded. Defaults to 'RateLimitExceeded'.
+        max_retries (int): Number of times a call that raised one of 'retry_on' is retried
+            before the exception is re-raised. Defaults to 0, which only backs off.
+        _now (Callable[[], float]): Monotonic clock used for pacing. Meant for tests.
+        _sleep (Callable[[float], None]): Function used to wait in synchronous wrappers. Meant
+            for tests.
+        _async_sleep (Callable[[float], Awaitable[Any]]): Coroutine function used to wait in
+            the wrappers of coroutine functions. Meant for tests.
 
     Returns:
         Callable[[F], F]: The decorator function that can be applied to any callable.
+
+    Raises:
+        ValueError: If 'burst' is less than 1, or if 'scope' is already registered with a
+            different 'rpm', 'burst', '_now' or '_sleep'.
     """
-    # Calculate the interval in seconds between allowed calls.
+    bucket = _get_bucket(rpm, burst, scope, shared, _now, _sleep)
+    sleep = _sleep
+    async_sleep = _async_sleep
     interval: float = 60.0 / rpm
-    # Use a lock to synchronize access in multi-threaded scenarios.
-    lock = threading.Lock()
-    last_call_time: float = 0.0
 
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            nonlocal last_call_time
-            with lock:
-                now: float = time.time()
-                elapsed: float = now - last_call_time
+    def decorator(func: F) -> F:
+        # Resolve the labelled counters once instead of on every call.
+        name: str = func.__qualname__
+        calls = calls_total.labels(name)
+        throttled = throttled_total.labels(name)
+        wait_time = wait_time_seconds_total.labels(name)
+        # Bound once so each call skips the attribute lookup on the bucket.
+        reserve = bucket.reserve
+        backoff = bucket.backoff
+        try_reserve = bucket.try_reserve
+        try_backoff = bucket.try_backoff
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                attempt: int = 0
+                while True:
+                    # A shared bucket's file lock may be held by another process; poll
+                    # for it instead of blocking the event loop.
+                    reservation: Optional[float] = try_reserve()
+                    while reservation is None:
+                        await async_sleep(_LOCK_POLL_INTERVAL)
+                        reservation = try_reserve()
+                    delay: float = reservation
+                    calls.inc()
+                    if delay > 0.0:
+                        throttled.inc()
+                        wait_time.inc(delay)
+                        await async_sleep(delay)
 
-                # If the elapsed time since the last call is less than the interval,
-                # sleep for the remaining time.
-                if elapsed < interval:
-                    time.sleep(interval - elapsed)
+                    # Await the actual coroutine function and return its result.
+                    try:
+                        return await func(*args, **kwargs)
+                    except retry_on as exc:
+                        retry_delay: float = _retry_delay(exc, interval, attempt)
+                        while not try_backoff(retry_delay):
+                            await async_sleep(_LOCK_POLL_INTERVAL)
+                        if attempt >= max_retries:
+                            raise
+                        attempt += 1
 
-                # Update the time of the last function call.
-                last_call_time = time.time()
+            return cast(F, async_wrapper)
+
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            attempt: int = 0
+            while True:
+                delay: float = reserve()
+                calls.inc()
+                if delay > 0.0:
+                    throttled.inc()
+                    wait_time.inc(delay)
+                    sleep(delay)
 
-            # Call the actual function and return its result.
-            return func(*args, **kwargs)
+                # Call the actual function and return its result.
+                try:
+                    return func(*args, **kwargs)
+                except retry_on as exc:
+                    # Push the limit back so every caller waits as long as the service asked.
+                    backoff(_retry_delay(exc, interval, attempt))
+                    if attempt >= max_retries:
+                        raise
+                    attempt += 1
 
-        return wrapper
+        return cast(F, wrapper)
 
     return decorator
@@ -0,0 +1,206 @@
+import os
+import re
+import mmap
+import stat
+import struct
+import tempfile
+import threading
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError as exc:  # pragma: no cover - Windows
+    raise ImportError(
+        "Process-shared rate limits require fcntl, which is only available on POSIX systems."
+    ) from exc
+
+from .main import TokenBucket, _monotonic, _sleep
+
+# Bucket state stored in the shared file: token balance and time of the last refill.
+_STATE = struct.Struct("dd")
+
+
+def state_path(scope: str) -> str:
+    """Return the path of the state file backing 'scope' for the current user."""
+    name: str = re.sub(r"[^\w.-]", "_", scope)
+    # Scoped per user, so other users can neither squat on nor share this user's limits.
+    return os.path.join(tempfile.gettempdir(), f"rateguard-{os.getuid()}-{name}.state")
+
+
+def _open_state_file(path: str) -> int:
+    # The temporary directory is world-writable, so refuse symlinks and files planted by other
+    # users; otherwise every reservation would write into a file of their choosing.
+    fd: int = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    info = os.fstat(fd)
+    if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid():
+        os.close(fd)
+        raise PermissionError(
+            f"Refusing to use {path!r} as rate limit state: it is not a regular file "
+            "owned by the current user."
+        )
+    return fd
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket whose state is shared by every process on the host that uses the same scope.
+
+    The token balance and last refill time live in a small memory-mapped file in the system's
+    temporary directory, named after the current user and the scope. Reservations lock the file
+    with 'fcntl.flock', so the bucket holds regardless of how many worker processes draw from
+    it; 'try_reserve' and 'try_backoff' give up instead of waiting for that lock, which lets
+    coroutines poll for it without blocking the event loop. Forked children reopen the file,
+    since flock locks belong to the open file description that parent and child would
+    otherwise share. The monotonic clock is system-wide, so timestamps written by one process
+    are valid in the others. All processes sharing a scope should use the same 'rpm' and
+    'burst'.
+
+    Args:
+        rpm (int): Number of tokens replenished per minute.
+        burst (int): Maximum number of tokens the bucket can hold.
+        scope (str): Name of the shared limit; it determines the state file.
+        clock (Callable[[], float]): Monotonic clock returning seconds. It must be system-wide
+            for the processes to agree on the refill time.
+        sleep (Callable[[float], None]): Function used by 'acquire' to wait.
+
+    Raises:
+        ValueError: If 'burst' is less than 1.
+        PermissionError: If the state file is not a regular file owned by the current user.
+        OSError: If the state file is a symbolic link or cannot be opened.
+    """
+
+    def __init__(
+        self,
+        rpm: int,
+        burst: int = 1,
+        scope: str = "default",
+        clock: Callable[[], float] = _monotonic,
+        sleep: Callable[[float], None] = _sleep,
+    ) -> None:
+        super().__init__(rpm, burst, clock, sleep)
+        self.scope: str = scope
+        self._open()
+        _open_buckets.append(self)
+
+    def _open(self) -> None:
+        self._fd: int = _open_state_file(state_path(self.scope))
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # The first process to open the scope starts it with a full bucket.
+            if os.fstat(self._fd).st_size < _STATE.size:
+                os.ftruncate(self._fd, _STATE.size)
+                self._state = mmap.mmap(self._fd, _STATE.size)
+                _STATE.pack_into(self._state, 0, self._capacity, self._clock())
+            else:
+                self._state = mmap.mmap(self._fd, _STATE.size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _reopen(self) -> None:
+        # The inherited lock may have been held by a thread that does not exist in the child,
+        # and the inherited descriptor shares its flock with the parent.
+        self._lock = threading.Lock()
+        self._state.close()
+        os.close(self._fd)
+        self._open()
+
+    def close(self) -> None:
+        """Release the state file. The bucket must not be used afterwards."""
+        if self in _open_buckets:
+            _open_buckets.remove(self)
+            self._state.close()
+            os.close(self._fd)
+
+    def _lock_state(self, blocking: bool = True) -> bool:
+        # flock does not exclude threads that share this file descriptor, so the local lock
+        # serializes them before the file lock serializes the processes.
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            fcntl.flock(
+                self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            )
+        except BlockingIOError:
+            self._lock.release()
+            return False
+        except BaseException:
+            self._lock.release()
+            raise
+        return True
+
+    def _unlock_state(self) -> None:
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def _refill(self) -> tuple[float, float]:
+        tokens, last_refill = _STATE.unpack_from(self._state)
+        now: float = self._clock()
+        # A refill time in the future was written before a reboot; start afresh.
+        if last_refill > now:
+            tokens, last_refill = self._capacity, now
+
+        tokens += (now - last_refill) * self._rate
+        if tokens > self._capacity:
+            tokens = self._capacity
+        return tokens, now
+
+    def _reserve_locked(self) -> float:
+        tokens, now = self._refill()
+        tokens -= 1.0
+        _STATE.pack_into(self._state, 0, tokens, now)
+        return -tokens * self._interval if tokens < 0.0 else 0.0
+
+    def _backoff_locked(self, delay: float) -> None:
+        tokens, now = self._refill()
+        # This balance refills to exactly one token after 'delay' seconds.
+        tokens = min(tokens, 1.0 - delay * self._rate)
+        _STATE.pack_into(self._state, 0, tokens, now)
+
+    def reserve(self) -> float:
+        """Consume a token from the shared bucket and return the seconds to wait before using it."""
+        self._lock_state()
+        try:
+            return self._reserve_locked()
+        finally:
+            self._unlock_state()
+
+    def backoff(self, delay: float) -> None:
+        """Hold back the next token of the shared bucket for at least 'delay' seconds from now."""
+        self._lock_state()
+        try:
+            self._backoff_locked(delay)
+        finally:
+            self._unlock_state()
+
+    def try_reserve(self) -> Optional[float]:
+        """Like 'reserve', but return None if the state file is locked by another caller."""
+        if not self._lock_state(blocking=False):
+            return None
+        try:
+            return self._reserve_locked()
+        finally:
+            self._unlock_state()
+
+    def try_backoff(self, delay: float) -> bool:
+        """Like 'backoff', but return False if the state file is locked by another caller."""
+        if not self._lock_state(blocking=False):
+            return False
+        try:
+            self._backoff_locked(delay)
+        finally:
+            self._unlock_state()
+        return True
+
+
+# Buckets with an open state file in this process. They are reopened in forked children;
+# native classes compiled with mypyc do not support weak references, so this holds them
+# until they are closed.
+_open_buckets: list[SharedTokenBucket] = []
+
+
+def _reopen_after_fork() -> None:
+    for bucket in _open_buckets:
+        bucket._reopen()
+
+
+os.register_at_fork(after_in_child=_reopen_after_fork)
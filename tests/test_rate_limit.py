@@ -1,16 +1,60 @@
+import os
 import time
-from rateguard.main import rate_limit
+import asyncio
+import tempfile
+import multiprocessing
+from datetime import timedelta
+
+import pytest
+
+from rateguard.main import RateLimitExceeded, _limiters, rate_limit
+
+
+class FakeClock:
+    """
+    Monotonic clock that only advances when slept on, so pacing can be tested without waiting.
+    """
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+    async def async_sleep(self, seconds: float) -> None:
+        # Concurrent sleepers overlap, so wake at the deadline instead of adding up their waits.
+        deadline = self.now + seconds
+        await asyncio.sleep(0)
+        self.now = max(self.now, deadline)
+
+
+@pytest.fixture(autouse=True)
+def clear_registry():
+    """
+    Drop scoped buckets after each test so that they don't leak into other tests.
+    """
+    yield
+    for bucket in _limiters.values():
+        close = getattr(bucket, "close", None)
+        if close is not None:
+            close()
+    _limiters.clear()
 
 
 def test_rate_limit_spacing():
     """
     Test that multiple calls to a rate-limited function are spaced by at least the minimum interval.
     """
+    clock = FakeClock()
     call_times = []
 
-    @rate_limit(60)  # 60 calls per minute => 1 call per second.
+    # 60 calls per minute => 1 call per second.
+    @rate_limit(60, _now=clock, _sleep=clock.sleep)
     def test_func() -> None:
-        call_times.append(time.time())
+        call_times.append(clock())
 
     # Call the test function three times.
     test_func()
@@ -37,3 +81,372 @@ def test_return_value_unchanged():
 
     result = add(3, 4)
     assert result == 7, f"Expected 7, got {result}"
+
+
+def test_scope_shares_limit():
+    """
+    Test that functions decorated with the same scope share a single rate limit.
+    """
+    clock = FakeClock()
+    call_times = []
+
+    # 60 calls per minute => 1 call per second.
+    @rate_limit(60, scope="test-shared", _now=clock, _sleep=clock.sleep)
+    def first() -> None:
+        call_times.append(clock())
+
+    @rate_limit(60, scope="test-shared", _now=clock, _sleep=clock.sleep)
+    def second() -> None:
+        call_times.append(clock())
+
+    first()
+    second()
+
+    elapsed = call_times[1] - call_times[0]
+    assert elapsed >= 1.0, f"Elapsed time {elapsed} is less than 1 second."
+
+
+def test_scope_rpm_mismatch():
+    """
+    Test that reusing a scope with a different rpm is rejected.
+    """
+    rate_limit(600, scope="test-mismatch")
+
+    with pytest.raises(ValueError):
+        rate_limit(60, scope="test-mismatch")
+
+
+def test_scope_clock_mismatch():
+    """
+    Test that reusing a scope with a different clock is rejected instead of silently sharing the
+    first one.
+    """
+    clock = FakeClock()
+    rate_limit(60, scope="test-clock", _now=clock, _sleep=clock.sleep)
+
+    with pytest.raises(ValueError):
+        rate_limit(60, scope="test-clock")
+
+    other = FakeClock()
+    with pytest.raises(ValueError):
+        rate_limit(60, scope="test-clock", _now=other, _sleep=other.sleep)
+
+    # The same clock and sleep are accepted.
+    rate_limit(60, scope="test-clock", _now=clock, _sleep=clock.sleep)
+
+    # The registered bucket waits with the injected sleep as well.
+    bucket = _limiters[("test-clock", False)]
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.now == 1.0
+
+
+def test_burst_allows_back_to_back_calls():
+    """
+    Test that saved-up tokens let 'burst' calls run immediately before pacing resumes.
+    """
+    clock = FakeClock()
+    call_times = []
+
+    # 60 calls per minute => 1 call per second, with up to 3 calls at once.
+    @rate_limit(60, burst=3, _now=clock, _sleep=clock.sleep)
+    def test_func() -> None:
+        call_times.append(clock())
+
+    for _ in range(4):
+        test_func()
+
+    # The first three calls use the initial burst and do not wait.
+    assert call_times[:3] == [0.0, 0.0, 0.0]
+
+    # The fourth call waits for a token to be replenished.
+    assert call_times[3] == 1.0
+
+    # After an idle period, the saved-up tokens allow another burst.
+    clock.sleep(10.0)
+    for _ in range(3):
+        test_func()
+    assert call_times[4:] == [11.0, 11.0, 11.0]
+
+
+def test_invalid_burst():
+    """
+    Test that a burst below one call is rejected.
+    """
+    with pytest.raises(ValueError):
+        rate_limit(60, burst=0)
+
+
+def test_async_rate_limit_spacing():
+    """
+    Test that calls to a rate-limited coroutine function are spaced without blocking the event loop.
+    """
+    clock = FakeClock()
+    events = []
+
+    # 60 calls per minute => 1 call per second.
+    @rate_limit(60, _now=clock, _async_sleep=clock.async_sleep)
+    async def test_func() -> None:
+        events.append(("call", clock()))
+
+    async def ticker() -> None:
+        # Keeps running while the rate-limited calls are waiting for their turn.
+        for _ in range(3):
+            events.append(("tick", clock()))
+            await asyncio.sleep(0)
+
+    async def run() -> None:
+        await asyncio.gather(test_func(), test_func(), test_func(), ticker())
+
+    asyncio.run(run())
+
+    call_times = [at for kind, at in events if kind == "call"]
+    assert call_times == [0.0, 1.0, 2.0]
+    # The ticker ran while the second call was waiting for its turn.
+    assert events.index(("tick", 0.0)) < events.index(("call", 1.0))
+
+
+def test_metrics_count_calls_and_waits():
+    """
+    Test that calls and waits are exported as Prometheus counters when prometheus_client is
+    installed.
+    """
+    prometheus_client = pytest.importorskip("prometheus_client")
+    clock = FakeClock()
+
+    # 60 calls per minute => 1 call per second.
+    @rate_limit(60, _now=clock, _sleep=clock.sleep)
+    def metered() -> None:
+        pass
+
+    metered()
+    metered()
+
+    labels = {"function": metered.__qualname__}
+    registry = prometheus_client.REGISTRY
+    assert registry.get_sample_value("rateguard_calls_total", labels) == 2
+    assert registry.get_sample_value("rateguard_throttled_total", labels) == 1
+    assert registry.get_sample_value("rateguard_wait_time_seconds_total", labels) == 1.0
+
+
+def test_shared_bucket_spans_instances(tmp_path, monkeypatch):
+    """
+    Test that independent shared buckets with the same scope draw from one limit, as separate
+    processes would.
+    """
+    pytest.importorskip("fcntl")
+    from rateguard.shared import SharedTokenBucket
+
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    # Each instance opens the state file on its own, just like another process would.
+    first = SharedTokenBucket(600, scope="test-shared-file")
+    second = SharedTokenBucket(600, scope="test-shared-file")
+
+    try:
+        assert first.reserve() == 0.0
+        # 600 calls per minute => the second token is 0.1 seconds away.
+        delay = second.reserve()
+        assert 0.09 < delay <= 0.1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_shared_bucket_rejects_unsafe_state_files(tmp_path, monkeypatch):
+    """
+    Test that a symlink or a non-regular file planted at the state path is never written to.
+    """
+    pytest.importorskip("fcntl")
+    from rateguard.shared import SharedTokenBucket, state_path
+
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    victim = tmp_path / "victim"
+    victim.write_bytes(b"do not overwrite")
+    os.symlink(victim, state_path("test-symlink"))
+    with pytest.raises(OSError):
+        SharedTokenBucket(60, scope="test-symlink")
+    assert victim.read_bytes() == b"do not overwrite"
+
+    os.mkfifo(state_path("test-fifo"))
+    with pytest.raises(PermissionError):
+        SharedTokenBucket(60, scope="test-fifo")
+
+
+def _reserve_many(bucket, count: int) -> None:
+    for _ in range(count):
+        bucket.reserve()
+
+
+def test_shared_bucket_across_forked_processes(tmp_path, monkeypatch):
+    """
+    Test that processes forked after the bucket was created draw from one limit without losing
+    reservations.
+    """
+    pytest.importorskip("fcntl")
+    from rateguard.shared import SharedTokenBucket, _STATE
+
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    context = multiprocessing.get_context("fork")
+
+    # Created in the parent, like a decorator applied at import time.
+    bucket = SharedTokenBucket(1, scope="test-shared-fork")
+    start = time.monotonic()
+
+    workers = [
+        context.Process(target=_reserve_many, args=(bucket, 2000)) for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    # 1 call per minute, so barely anything is refilled while the workers run.
+    tokens, _ = _STATE.unpack_from(bucket._state)
+    bucket.close()
+    refilled = (time.monotonic() - start) / 60.0
+    assert tokens <= 1.0 - 8000 + refilled + 1e-6
+
+
+def test_shared_rate_limit_spacing(tmp_path, monkeypatch):
+    """
+    Test that a process-shared rate limit spaces calls like the in-process one.
+    """
+    pytest.importorskip("fcntl")
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    clock = FakeClock()
+    call_times = []
+
+    # 60 calls per minute => 1 call per second.
+    @rate_limit(
+        60, scope="test-shared-decorator", shared=True, _now=clock, _sleep=clock.sleep
+    )
+    def test_func() -> None:
+        call_times.append(clock())
+
+    test_func()
+    test_func()
+
+    elapsed = call_times[1] - call_times[0]
+    assert elapsed >= 1.0, f"Elapsed time {elapsed} is less than 1 second."
+    assert (tmp_path / f"rateguard-{os.getuid()}-test-shared-decorator.state").exists()
+
+
+def test_shared_async_rate_limit_polls_for_the_file_lock(tmp_path, monkeypatch):
+    """
+    Test that a coroutine waits for a state file locked by another process without blocking
+    the event loop.
+    """
+    fcntl = pytest.importorskip("fcntl")
+    from rateguard.shared import state_path
+
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    clock = FakeClock()
+    polls = []
+
+    async def async_sleep(seconds: float) -> None:
+        polls.append(seconds)
+        await clock.async_sleep(seconds)
+
+    @rate_limit(
+        60,
+        scope="test-shared-async",
+        shared=True,
+        _now=clock,
+        _sleep=clock.sleep,
+        _async_sleep=async_sleep,
+    )
+    async def test_func() -> str:
+        return "done"
+
+    async def run() -> str:
+        # A separate open file description stands in for another process holding the lock.
+        fd = os.open(state_path("test-shared-async"), os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            task = asyncio.ensure_future(test_func())
+            # The event loop keeps running while the call is waiting for the lock.
+            for _ in range(3):
+                await asyncio.sleep(0)
+            assert not task.done()
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        return await task
+
+    assert asyncio.run(run()) == "done"
+    assert polls
+
+
+def test_retry_after_pushes_back_the_limit():
+    """
+    Test that a RateLimitExceeded with a retry hint delays the retry by the requested time.
+    """
+    clock = FakeClock()
+    call_times = []
+
+    # 60 calls per minute => 1 call per second.
+    @rate_limit(60, max_retries=1, _now=clock, _sleep=clock.sleep)
+    def test_func() -> str:
+        call_times.append(clock())
+        if len(call_times) == 1:
+            raise RateLimitExceeded(retry_after=5.0)
+        return "ok"
+
+    assert test_func() == "ok"
+    assert call_times == [0.0, 5.0]
+
+
+def test_rate_limit_exceeded_is_reraised():
+    """
+    Test that a rate limit error is re-raised once retries are exhausted, and that the next call
+    still honors the backoff.
+    """
+    clock = FakeClock()
+    call_times = []
+
+    # 60 calls per minute => 1 call per second.
+    @rate_limit(60, _now=clock, _sleep=clock.sleep)
+    def test_func() -> None:
+        call_times.append(clock())
+        if len(call_times) == 1:
+            # Without a hint, the first backoff is one regular interval.
+            raise RateLimitExceeded()
+
+    with pytest.raises(RateLimitExceeded):
+        test_func()
+
+    test_func()
+    assert call_times == [0.0, 1.0]
+
+
+def test_retry_on_custom_exception():
+    """
+    Test that provider exceptions listed in retry_on are retried using their retry_delay hint.
+    """
+
+    class ResourceExhausted(Exception):
+        retry_delay = timedelta(seconds=30)
+
+    clock = FakeClock()
+    call_times = []
+
+    @rate_limit(
+        60,
+        retry_on=(ResourceExhausted,),
+        max_retries=2,
+        _now=clock,
+        _sleep=clock.sleep,
+    )
+    def test_func() -> None:
+        call_times.append(clock())
+        raise ResourceExhausted()
+
+    with pytest.raises(ResourceExhausted):
+        test_func()
+
+    assert call_times == [0.0, 30.0, 60.0]